@@ -4,7 +4,16 @@ import configparser
 import sqlite3
 import datetime
 import time
+import threading
+import queue
+import logging
+import logging.handlers
+import atexit
+import importlib.util
+import io
+from collections import deque
 from functools import partial
+from itertools import islice
 
 # --- Determine the base directory of the script to ensure files are saved in the correct place ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,28 +25,48 @@ from PySide6.QtWidgets import (
     QSpinBox, QColorDialog, QCheckBox, QGroupBox, QDialog, QDateTimeEdit,
     QDoubleSpinBox
 )
-from PySide6.QtCore import QThread, Signal, Qt, QTimer, QDateTime
+from PySide6.QtCore import QThread, Signal, Slot, Qt, QTimer, QDateTime
 from PySide6.QtGui import QColor, QFont
 
-# Third-party libraries for plotting and OPC UA
+# Third-party plotting libraries (pyqtgraph loads numpy anyway). pandas, openpyxl, opcua and
+# pyqtgraph.exporters are slow to import and only needed once a client connects or data is
+# loaded/exported, so they are imported inside the methods that use them.
+import numpy as np
 import pyqtgraph as pg
-import pyqtgraph.exporters
-import pandas as pd
-from opcua import Client
+HAVE_OPENGL = importlib.util.find_spec("OpenGL") is not None  # PyOpenGL is optional; only probed, not imported, here
 
 
 # #############################################################################
 # UTILITY - GMP-INSPIRED LOGGER
 # #############################################################################
 
+class _IsoFormatter(logging.Formatter):
+    """Stamps records with the local ISO-8601 time at which the event was logged."""
+    def formatTime(self, record, datefmt=None):
+        return datetime.datetime.fromtimestamp(record.created).isoformat()
+
+def _create_audit_logger():
+    """Routes audit records through a queue to a listener thread that keeps the log file open."""
+    # Deliberately not a rotating handler: rotation deletes the oldest audit records
+    file_handler = logging.FileHandler(os.path.join(BASE_DIR, "gmp_audit_log.txt"), delay=True); file_handler.setFormatter(_IsoFormatter("%(asctime)s - %(message)s"))
+    log_queue = queue.Queue(-1); listener = logging.handlers.QueueListener(log_queue, file_handler); listener.start(); atexit.register(listener.stop)
+    logger = logging.getLogger("audit"); logger.setLevel(logging.INFO); logger.propagate = False; logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+AUDIT = _create_audit_logger()
+
 def log_event(message):
     """Logs an event to a file with a timestamp for audit purposes."""
-    try:
-        log_path = os.path.join(BASE_DIR, "gmp_audit_log.txt")
-        with open(log_path, "a") as log_file:
-            log_file.write(f"{datetime.datetime.now().isoformat()} - {message}\n")
-    except Exception as e:
-        print(f"Failed to write to audit log: {e}")
+    AUDIT.info(message)
+
+def _to_float(value):
+    try: return float(value)
+    except (TypeError, ValueError): return np.nan
+
+def samples_to_array(samples, keys):
+    """Casts sample dicts to a float64 [sample, key] array in one go; missing and non-numeric values become NaN."""
+    try: return np.array([list(map(data.get, keys)) for data in samples], dtype=np.float64) # map() looks the keys up without a Python-level loop
+    except (TypeError, ValueError): return np.array([[_to_float(data.get(key)) for key in keys] for data in samples], dtype=np.float64) # A non-numeric value in the batch
 
 
 # #############################################################################
@@ -46,25 +75,28 @@ def log_event(message):
 
 class ConfigManager:
     """Handles reading and writing the application's configuration file."""
+    TAG_KEYS = ('ph', 'do', 'temp', 'variable1', 'variable2', 'variable3', 'variable4', 'variable5', 'variable6', 'variable7')
     def __init__(self, filename="config.ini"):
         self.filename = os.path.join(BASE_DIR, filename)
-        self.config = configparser.ConfigParser()
+        self.config = configparser.ConfigParser(); self._saved_text = None
         if not os.path.exists(self.filename):
             self._create_default_config()
         else:
-            self.config.read(self.filename)
+            self.config.read(self.filename); self._saved_text = self._serialize()
             if self._validate_and_update_config():
                 self.save_config()
                 log_event("INFO: Configuration file was updated with new default values.")
+        self._refresh_cache()
 
     def _get_default_config(self):
         default_parser = configparser.ConfigParser()
         default_parser['OPC_SERVER'] = {'address': 'opc.tcp://localhost:4840/freeopcua/server/'}
-        default_parser['SETTINGS'] = {'polling_interval_ms': '1000'}
+        default_parser['SETTINGS'] = {'polling_interval_ms': '1000', 'db_flush_batch_size': '500', 'db_flush_interval_s': '30', 'use_opengl': 'false'}
         default_parser['TAGS'] = {'ph_name': 'pH', 'ph_nodeid': 'ns=2;i=2', 'ph_setpoint_nodeid': 'ns=2;i=10', 'do_name': 'DO', 'do_nodeid': 'ns=2;i=3', 'do_setpoint_nodeid': 'ns=2;i=11', 'temp_name': 'Temperature', 'temp_nodeid': 'ns=2;i=4', 'temp_setpoint_nodeid': 'ns=2;i=12', 'variable1_name': 'Variable 1', 'variable1_nodeid': 'ns=2;i=5', 'variable2_name': 'Variable 2', 'variable2_nodeid': 'ns=2;i=6', 'variable3_name': 'Variable 3', 'variable3_nodeid': 'ns=2;i=7', 'variable4_name': 'Variable 4', 'variable4_nodeid': 'ns=2;i=8', 'variable5_name': 'Variable 5', 'variable5_nodeid': 'ns=2;i=13', 'variable6_name': 'Variable 6', 'variable6_nodeid': 'ns=2;i=14', 'variable7_name': 'Variable 7', 'variable7_nodeid': 'ns=2;i=15', 'run_start_nodeid': 'ns=2;i=9'}
         default_parser['PLOT_COLORS'] = {'ph_color': '#1f77b4', 'ph_setpoint_color': '#aec7e8', 'do_color': '#ff7f0e', 'do_setpoint_color': '#ffbb78', 'temp_color': '#d62728', 'temp_setpoint_color': '#ff9896', 'variable1_color': '#2ca02c', 'variable2_color': '#98df8a', 'variable3_color': '#9467bd', 'variable4_color': '#c5b0d5', 'variable5_color': '#8c564b', 'variable6_color': '#c49c94', 'variable7_color': '#e377c2'}
         default_parser['AXIS_LIMITS'] = {'ph_ymin': '6', 'ph_ymax': '8', 'do_ymin': '0', 'do_ymax': '100', 'temp_ymin': '20', 'temp_ymax': '40', 'variable_ymin': '0', 'variable_ymax': '50'}
-        default_parser['UI_STATE'] = {'variable1': 'false', 'variable2': 'false', 'variable3': 'false', 'variable4': 'false', 'variable5': 'false', 'variable6': 'false', 'variable7': 'false'}
+        default_parser['LOGGING'] = {'binary_sink': 'false'}
+        default_parser['UI_STATE'] = {'variable1': 'false', 'variable2': 'false', 'variable3': 'false', 'variable4': 'false', 'variable5': 'false', 'variable6': 'false', 'variable7': 'false', 'last_export_dir': ''}
         return default_parser
 
     def _create_default_config(self):
@@ -76,113 +108,336 @@ class ConfigManager:
             for key, value in default_config.items(section):
                 if not self.config.has_option(section, key): self.config.set(section, key, value); was_updated = True
         return was_updated
+    def _refresh_cache(self):
+        """Snapshots the sections read on every plot refresh into plain dicts."""
+        self.tags = dict(self.config['TAGS']); self.plot_colors = dict(self.config['PLOT_COLORS']); self.axis_limits = dict(self.config['AXIS_LIMITS'])
+        names = {key[:-len('_name')]: name for key, name in self.tags.items() if key.endswith('_name')}
+        self.rename_map = {**names, **{f"{tag}_setpoint": f"{name} SP" for tag, name in names.items()}}  # tag key -> display name for exports
+        self._tag_nodeids = tuple((key[:-len('_nodeid')], nid) for key, nid in self.tags.items() if nid and key.endswith('_nodeid'))
+    def iter_tag_nodeids(self):
+        """Yields (tag, node id) for every configured node, e.g. ('ph_setpoint', 'ns=2;i=10')."""
+        return iter(self._tag_nodeids)
     def get_config(self):
-        self.config.read(self.filename); return self.config
+        return self.config
+    def reload(self):
+        """Re-reads the file to pick up edits made outside the application."""
+        self.config.read(self.filename); self._saved_text = self._serialize(); self._refresh_cache(); return self.config
+    def _serialize(self):
+        text = io.StringIO(); self.config.write(text); return text.getvalue()
     def save_config(self):
-        with open(self.filename, 'w') as configfile: self.config.write(configfile); log_event("INFO: Configuration saved.")
+        """Writes the configuration through to the file, skipping the write when nothing changed since the last read or save."""
+        text = self._serialize()
+        if text != self._saved_text:
+            with open(self.filename, 'w') as configfile: configfile.write(text)
+            self._saved_text = text; log_event("INFO: Configuration saved.")
+        self._refresh_cache()
+
+class _XlsxWriterWorkbook:
+    """Streams an .xlsx with xlsxwriter's constant-memory mode behind the openpyxl write-only calls used by export_to_excel."""
+    def __init__(self, output_path):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    def create_sheet(self, title): return _XlsxWriterSheet(self.workbook.add_worksheet(title))
+    def save(self, output_path): self.workbook.close()
+
+class _XlsxWriterSheet:
+    def __init__(self, worksheet): self.worksheet = worksheet; self.row = 0
+    def append(self, values): self.worksheet.write_row(self.row, 0, values); self.row += 1
 
 class DatabaseManager:
+    COLUMNS = ('timestamp', 'ph', 'ph_setpoint', 'do', 'do_setpoint', 'temperature', 'temp_setpoint', 'variable1', 'variable2', 'variable3', 'variable4', 'variable5', 'variable6', 'variable7', 'bioreactor_status')
+    # Sample dict key feeding each column; the temperature tag is keyed 'temp' by the client thread
+    ROW_KEYS = tuple('temp' if c == 'temperature' else c for c in COLUMNS)
+    INSERT_PREFIX = f"INSERT INTO sensordata ({', '.join(COLUMNS)}) VALUES "
+    INSERT_SUFFIX = " ON CONFLICT(timestamp) DO NOTHING"  # A sample already stored for a timestamp is kept
+    ROW_PLACEHOLDERS = f"({', '.join(['?'] * len(COLUMNS))})"
+    # Rows per multi-row INSERT; 50 rows x 15 columns stays below SQLite's 999 bound-parameter limit
+    INSERT_CHUNK_ROWS = 50
+    INSERT_CHUNK_SQL = INSERT_PREFIX + ", ".join([ROW_PLACEHOLDERS] * INSERT_CHUNK_ROWS) + INSERT_SUFFIX
+    EXPORT_CHUNK_ROWS = 100_000
+
     def __init__(self, db_path):
-        self.db_path = db_path; self.conn = sqlite3.connect(self.db_path, check_same_thread=False); self.conn.execute("PRAGMA journal_mode=WAL;"); self._create_table(); log_event(f"INFO: Database connection established for '{self.db_path}'.")
+        # Autocommit mode: insert_bulk_data manages its own transactions with one reusable cursor
+        self.db_path = db_path; self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None); self._cursor = self.conn.cursor(); self.conn.execute("PRAGMA journal_mode=WAL;")
+        # With WAL, synchronous=NORMAL only fsyncs at checkpoints. Committed data survives an application
+        # crash; a power loss or OS crash can roll back the last few commits, but never corrupts the file.
+        self.conn.execute("PRAGMA synchronous=NORMAL;"); self.conn.execute("PRAGMA temp_store=MEMORY;"); self.conn.execute("PRAGMA cache_size=-20000;"); self.conn.execute("PRAGMA wal_autocheckpoint=1000;")
+        # Memory-map up to 256 MB of the file so export and history reads skip the read() copy into the page cache
+        self.conn.execute("PRAGMA mmap_size=268435456;")
+        self._create_table(); log_event(f"INFO: Database connection established for '{self.db_path}'.")
     def _create_table(self):
-        cursor = self.conn.cursor(); cursor.execute("""CREATE TABLE IF NOT EXISTS sensordata (timestamp REAL PRIMARY KEY, ph REAL, ph_setpoint REAL, do REAL, do_setpoint REAL, temperature REAL, temp_setpoint REAL, variable1 REAL, variable2 REAL, variable3 REAL, variable4 REAL, variable5 REAL, variable6 REAL, variable7 REAL, bioreactor_status TEXT)"""); self.conn.commit()
+        cursor = self.conn.cursor(); cursor.execute("""CREATE TABLE IF NOT EXISTS sensordata (timestamp REAL PRIMARY KEY, ph REAL, ph_setpoint REAL, do REAL, do_setpoint REAL, temperature REAL, temp_setpoint REAL, variable1 REAL, variable2 REAL, variable3 REAL, variable4 REAL, variable5 REAL, variable6 REAL, variable7 REAL, bioreactor_status TEXT)""")
+        # Covers the STARTED lookup in export_to_excel without scanning the table. Partial, so the bulk inserts
+        # (status is NULL for nearly every sample) skip index maintenance.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_set ON sensordata(bioreactor_status, timestamp) WHERE bioreactor_status IS NOT NULL")
     
     def insert_bulk_data(self, data_list):
-        """ **NEW** Inserts a list of data dictionaries in a single transaction. """
+        """ **NEW** Inserts data dictionaries from a list or any other iterable in a single transaction. """
         if not data_list:
-            return
+            return True
+        # Fixed column order; tags missing from a sample are stored as NULL
+        return self.insert_rows([row.get(k) for k in self.ROW_KEYS] for row in data_list)
+
+    def insert_rows(self, rows):
+        """Inserts value sequences in COLUMNS order in a single transaction; returns False if it was rolled back."""
+        rows = iter(rows); count = 0
         try:
-            cursor = self.conn.cursor()
-            # Assume all dicts have the same keys, get them from the first item
-            keys = sorted(data_list[0].keys())
-            placeholders = f"({', '.join(['?'] * len(keys))})"
-            
-            # Convert list of dicts to list of tuples
-            rows_to_insert = [[row.get(k) for k in keys] for row in data_list]
-            
-            sql = f"INSERT OR IGNORE INTO sensordata ({', '.join(keys)}) VALUES {placeholders}"
-            cursor.executemany(sql, rows_to_insert)
-            self.conn.commit()
-            log_event(f"INFO: Flushed {len(rows_to_insert)} records to '{self.db_path}'.")
+            # Take the write lock up front so a concurrent reader can't force a lock upgrade mid-transaction
+            self._cursor.execute("BEGIN IMMEDIATE")
+            try:
+                while chunk := list(islice(rows, self.INSERT_CHUNK_ROWS)):
+                    sql = self.INSERT_CHUNK_SQL if len(chunk) == self.INSERT_CHUNK_ROWS else self.INSERT_PREFIX + ", ".join([self.ROW_PLACEHOLDERS] * len(chunk)) + self.INSERT_SUFFIX
+                    self._cursor.execute(sql, [value for row in chunk for value in row]); count += len(chunk)
+                self._cursor.execute("COMMIT")
+            except Exception:
+                if self.conn.in_transaction: self._cursor.execute("ROLLBACK")
+                raise
+            log_event(f"INFO: Flushed {count} records to '{self.db_path}'."); return True
         except Exception as e:
-            log_event(f"ERROR: Database bulk insert failed in '{self.db_path}': {e}")
+            log_event(f"ERROR: Database bulk insert failed in '{self.db_path}': {e}"); return False
 
     def get_all_data_as_dataframe(self):
+        import pandas as pd
+        query = "SELECT * FROM sensordata ORDER BY timestamp ASC"
         try:
-            query = "SELECT * FROM sensordata ORDER BY timestamp ASC"; df = pd.read_sql_query(query, self.conn); return df
+            # connectorx (optional) builds the columns natively instead of fetching row tuples through the DB-API
+            import connectorx as cx
+            return cx.read_sql(f"sqlite://{os.path.abspath(self.db_path)}", query, return_type="pandas")
+        except ImportError: pass
+        except Exception as e: log_event(f"WARNING: connectorx read failed for '{self.db_path}', using pandas. Details: {e}")
+        try:
+            df = pd.read_sql_query(query, self.conn); return df
         except Exception as e: log_event(f"ERROR: Failed to read all data from '{self.db_path}': {e}"); return pd.DataFrame()
-    def export_to_excel(self, output_path, start_ts, end_ts, interval_s, config):
+    def export_to_excel(self, output_path, start_ts, end_ts, interval_s, rename_map):
+        import pandas as pd
         try:
-            query = f"SELECT * FROM sensordata WHERE timestamp BETWEEN {start_ts} AND {end_ts} ORDER BY timestamp ASC"; df = pd.read_sql_query(query, self.conn)
-            if df.empty: return False, "No data found in the selected time range."
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='s'); df.set_index('datetime', inplace=True)
-            if interval_s > 0: df = df.resample(f'{interval_s}S').mean().reset_index()
-            start_event_df = pd.read_sql_query("SELECT timestamp FROM sensordata WHERE bioreactor_status = 'STARTED' ORDER BY timestamp ASC LIMIT 1", self.conn); start_timestamp = start_event_df['timestamp'].iloc[0] if not start_event_df.empty else None
-            if start_timestamp: df['EFT_seconds'] = (df['datetime'] - pd.to_datetime(start_timestamp, unit='s')).dt.total_seconds()
-            else: df['EFT_seconds'] = "N/A (Reactor not started)"
-            tags_config = config['TAGS']; rename_map = {key.replace('_name',''): name for key, name in tags_config.items() if key.endswith('_name')}; rename_map.update({f"{key.replace('_name','')}_setpoint": f"{name} SP" for key, name in tags_config.items() if key.endswith('_name')}); df.rename(columns=rename_map, inplace=True)
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Data', index=False); notes_text = f"Data export from BIOne OPC Logger.\nExported Range: {datetime.datetime.fromtimestamp(start_ts)} to {datetime.datetime.fromtimestamp(end_ts)}.\nData Interval: {interval_s} seconds."; pd.DataFrame({'Notes': [notes_text]}).to_excel(writer, sheet_name='Notes', index=False)
+            start_event_df = pd.read_sql_query("SELECT timestamp FROM sensordata WHERE bioreactor_status = ? ORDER BY timestamp ASC LIMIT 1", self.conn, params=('STARTED',)); start_timestamp = start_event_df['timestamp'].iloc[0] if not start_event_df.empty else None
+            header_map = {col: rename_map.get(key, col) for col, key in zip(self.COLUMNS, self.ROW_KEYS)}
+            query = "SELECT * FROM sensordata WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp ASC"; chunks = pd.read_sql_query(query, self.conn, params=(start_ts, end_ts), chunksize=self.EXPORT_CHUNK_ROWS)
+            if interval_s > 0: chunks = [self._resample_chunks(chunks, interval_s)]
+            wb = None
+            for df in chunks:
+                if df.empty: continue
+                if 'datetime' not in df.columns: df.insert(0, 'datetime', pd.to_datetime(df['timestamp'], unit='s'))
+                if start_timestamp: df['EFT_seconds'] = (df['datetime'] - pd.to_datetime(start_timestamp, unit='s')).dt.total_seconds()
+                else: df['EFT_seconds'] = "N/A (Reactor not started)"
+                df = df.rename(columns=header_map)
+                if wb is None: wb = self._new_workbook(output_path); ws = wb.create_sheet('Data'); ws.append(list(df.columns))
+                for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None): ws.append(row)
+            if wb is None: return False, "No data found in the selected time range."
+            notes_text = f"Data export from BIOne OPC Logger.\nExported Range: {datetime.datetime.fromtimestamp(start_ts)} to {datetime.datetime.fromtimestamp(end_ts)}.\nData Interval: {interval_s} seconds."; notes_ws = wb.create_sheet('Notes'); notes_ws.append(['Notes']); notes_ws.append([notes_text])
+            wb.save(output_path)
             log_event(f"INFO: Data successfully exported to {output_path}"); return True, "Export successful."
         except Exception as e: log_event(f"ERROR: Failed to export data to Excel: {e}"); return False, f"An error occurred: {e}"
+    def _new_workbook(self, output_path):
+        """Returns a streaming workbook: xlsxwriter (optional, several times faster) or openpyxl write-only mode."""
+        try: return _XlsxWriterWorkbook(output_path)
+        except ImportError: import openpyxl; return openpyxl.Workbook(write_only=True)
+    def _resample_chunks(self, chunks, interval_s):
+        """Averages chunked query results into interval_s bins while only holding per-bin sums and counts."""
+        import pandas as pd
+        numeric_cols = [c for c in self.COLUMNS if c != 'bioreactor_status']; rule = f'{interval_s}s'; sums = []; counts = []; statuses = []
+        for chunk in chunks:
+            if chunk.empty: continue
+            index = pd.DatetimeIndex(pd.to_datetime(chunk['timestamp'], unit='s'), name='datetime')
+            values = chunk[numeric_cols].astype('float64').set_axis(index); bins = values.resample(rule); sums.append(bins.sum(min_count=1)); counts.append(bins.count())
+            statuses.append(chunk['bioreactor_status'].set_axis(index).resample(rule).last())
+        if not sums: return pd.DataFrame()
+        # A bin split across two chunks appears twice; the final resample merges it and restores empty bins
+        totals = pd.concat(sums).resample(rule).sum(min_count=1); samples = pd.concat(counts).resample(rule).sum()
+        result = totals / samples; result['bioreactor_status'] = pd.concat(statuses).groupby(level=0).last()
+        return result.reset_index()
+
+class BinaryLogger:
+    """Append-only sample log of fixed-size records in a memory-mapped file, imported into SQLite in one transaction."""
+    # Numeric columns as float64 (NaN = missing) plus the STARTED marker as one byte
+    FIELDS = DatabaseManager.COLUMNS[:-1]; KEYS = DatabaseManager.ROW_KEYS[:-1]
+    DTYPE = np.dtype([(column, 'f8') for column in FIELDS] + [('started', 'u1')])
+    GROW_ROWS = 65536  # Records added to the file each time it fills up (~7 MB)
+    IMPORT_CHUNK_ROWS = 10_000  # Records converted to Python tuples at a time while importing
+    def __init__(self, path):
+        self.path = path; self._arr = None; self._n = 0
+        if os.path.exists(path) and os.path.getsize(path) >= self.DTYPE.itemsize:
+            # Left over from a session that did not import it; the file is zero-filled past the last record
+            self._map(os.path.getsize(path) // self.DTYPE.itemsize); unused = np.flatnonzero(self._arr['timestamp'] == 0); self._n = int(unused[0]) if len(unused) else len(self._arr)
+        else: self._map(self.GROW_ROWS)
+    def __len__(self): return self._n
+    def _map(self, rows):
+        if self._arr is not None: self._arr.flush()
+        self._arr = np.memmap(self.path, dtype=self.DTYPE, mode='r+' if os.path.exists(self.path) else 'w+', shape=(rows,))
+    def append_rows(self, batch):
+        if not batch: return
+        n = self._n; m = len(batch)
+        if n + m > len(self._arr): self._map(max(len(self._arr) + self.GROW_ROWS, n + m))
+        records = self._arr[n:n + m]; values = samples_to_array(batch, self.KEYS)
+        for i, field in enumerate(self.FIELDS): records[field] = values[:, i]
+        records['started'] = [data.get('bioreactor_status') == 'STARTED' for data in batch]; self._n = n + m
+    def import_into(self, db_manager):
+        """Bulk-loads the logged records into the database; returns True once they are stored there."""
+        if not self._n: return True
+        return db_manager.insert_rows(self._iter_rows())
+    def _iter_rows(self):
+        for start in range(0, self._n, self.IMPORT_CHUNK_ROWS):
+            for record in self._arr[start:min(start + self.IMPORT_CHUNK_ROWS, self._n)].tolist(): yield (*record[:-1], 'STARTED' if record[-1] else None)
+    def close(self, discard=False):
+        self._arr.flush(); self._arr = None
+        if discard: os.remove(self.path)
+
+class SubHandler:
+    """Receives OPC UA data change notifications and keeps the latest value and receipt time of every tag."""
+    def __init__(self, node_to_name):
+        # No tag counts as current until a notification or a successful read arrives for it
+        self.node_to_name = node_to_name; self.latest = dict.fromkeys(node_to_name.values()); self.updated = dict.fromkeys(node_to_name.values(), float('-inf')); self.alive = True; self.lock = threading.Lock()
+
+    def datachange_notification(self, node, val, data):
+        name = self.node_to_name.get(node)
+        if name is not None:
+            # A value reported with bad quality is recorded as missing, like a failed read
+            value = val if data.monitored_item.Value.StatusCode.is_good() else None
+            with self.lock: self.latest[name] = value; self.updated[name] = time.monotonic()
+
+    def status_change_notification(self, status):
+        """Called when the server ends the subscription (e.g. BadTimeout); values are no longer pushed after this."""
+        with self.lock: self.alive = False; self.latest = dict.fromkeys(self.latest)
+        log_event(f"WARNING: OPC-UA subscription status changed to {status}; reading values directly.")
+
+    def refresh(self, names, values):
+        """Stores values obtained by a direct read as the latest ones."""
+        now = time.monotonic()
+        with self.lock:
+            for name, value in zip(names, values): self.latest[name] = value; self.updated[name] = now
+
+    def is_stale(self, max_age_s):
+        """True when the subscription ended or any tag has gone max_age_s without an update."""
+        now = time.monotonic()
+        with self.lock: return not self.alive or any(now - t > max_age_s for t in self.updated.values())
+
+    def snapshot(self):
+        with self.lock: return dict(self.latest)
 
 class OpcClientThread(QThread):
-    data_received = Signal(dict); status_changed = Signal(str); reactor_started = Signal(float)
-    def __init__(self, config, db_path):
-        super().__init__(); self.config = config; self.db_path = db_path; self.running = False; self.reactor_start_time = None; self.data_cache = []
+    data_batch = Signal(object); status_changed = Signal(str); reactor_started = Signal(float)
+    EMIT_BATCH_SIZE = 5; EMIT_INTERVAL_S = 0.5  # Samples are sent to the GUI in batches to limit cross-thread signals
+    CACHE_MAX_SAMPLES = 10000  # Samples held while the database writer is behind; the oldest are dropped beyond this
+    FLUSH_BATCH_SIZE = 500; FLUSH_INTERVAL_S = 30  # Defaults for 'db_flush_batch_size' / 'db_flush_interval_s'
+    STALE_AFTER_INTERVALS = 3  # Polling periods without a notification before subscribed values are re-read directly
+    def __init__(self, config_manager, db_path):
+        super().__init__(); self.config_manager = config_manager; self.config = config_manager.config; self.db_path = db_path; self.running = False; self.reactor_start_time = None; self._prev_run_start = None; self._cache = deque(maxlen=self.CACHE_MAX_SAMPLES); self._cache_cond = threading.Condition(); self._stop_writer = False; self._dropped_samples = 0; self._emit_buf = []; self._flush_batch_size = self.FLUSH_BATCH_SIZE; self._flush_interval_s = self.FLUSH_INTERVAL_S; self._binlog = None
     
     def run(self):
         self.db_manager = DatabaseManager(self.db_path)
-        self.running = True; is_connected = False; client = None
-        
-        # --- Caching Timer ---
-        self.db_timer = QTimer()
-        self.db_timer.setInterval(30000) # 30 seconds
-        self.db_timer.timeout.connect(self._flush_cache_to_db)
-        
-        address = self.config['OPC_SERVER']['address']; tags_config = self.config['TAGS']
+        self.running = True; is_connected = False; client = None; sub = None
+        try: self._flush_batch_size = max(1, self.config.getint('SETTINGS', 'db_flush_batch_size')); self._flush_interval_s = max(0.1, self.config.getfloat('SETTINGS', 'db_flush_interval_s'))
+        except (ValueError, configparser.NoOptionError): self._flush_batch_size = self.FLUSH_BATCH_SIZE; self._flush_interval_s = self.FLUSH_INTERVAL_S; log_event(f"WARNING: Invalid database flush settings in config. Using defaults {self.FLUSH_BATCH_SIZE} rows / {self.FLUSH_INTERVAL_S}s.")
+
+        self._binlog = self._open_binary_log()
+
+        # --- Database writer: drains the sample cache so disk stalls never delay the OPC reads ---
+        writer = threading.Thread(target=self._writer_loop, daemon=True); writer.start()
+
+        address = self.config['OPC_SERVER']['address']
         try: poll_ms = self.config.getint('SETTINGS', 'polling_interval_ms')
         except (ValueError, configparser.NoOptionError): poll_ms = 1000; log_event(f"WARNING: Invalid 'polling_interval_ms' in config. Using default {poll_ms}ms.")
         poll_interval_s = poll_ms / 1000.0
-        node_ids_to_poll = {name.replace('_nodeid', '').replace('_name', ''): nid for name, nid in tags_config.items() if nid and name.endswith('_nodeid')}
-        
+
         try:
-            client = Client(address); client.connect(); is_connected = True; self.status_changed.emit(f"Connected to {address}"); log_event(f"OPC-UA: Successfully connected to {address}."); nodes = {name: client.get_node(nid) for name, nid in node_ids_to_poll.items()}
-            self.db_timer.start() # Start the cache flushing timer
-            
+            from opcua import Client
+            client = Client(address); client.connect(); is_connected = True; self.status_changed.emit(f"Connected to {address}"); log_event(f"OPC-UA: Successfully connected to {address}."); nodes = {name: client.get_node(nid) for name, nid in self.config_manager.iter_tag_nodeids()}
+
+            # Let the server push value changes; each cycle only samples the latest values.
+            # Servers without subscription support fall back to one batched ReadRequest per cycle.
+            name_list = list(nodes.keys()); node_list = list(nodes.values())
+            handler = SubHandler({node: name for name, node in nodes.items()})
+            try: sub = client.create_subscription(poll_ms, handler); sub.subscribe_data_change(node_list)
+            except Exception as e:
+                if sub:
+                    try: sub.delete() # Don't leave the server-side subscription behind
+                    except Exception: pass
+                sub = None; log_event(f"WARNING: OPC-UA subscription failed, falling back to polling. Details: {e}")
+            # A quiet subscription can mean unchanged values or a lost server; a direct read tells them apart
+            stale_after_s = self.STALE_AFTER_INTERVALS * poll_interval_s
+            # Schedule cycles against a monotonic deadline so read and signal time does not stretch the period;
+            # time.time() is only used for the wall-clock sample timestamp
+            next_deadline = time.monotonic(); last_emit = next_deadline
             while self.running:
-                data = {'timestamp': time.time()}; status_note = None
-                for name, node in nodes.items():
-                    try:
-                        if name == 'run_start' and not self.reactor_start_time:
-                            if node.get_value() == 1: self.reactor_start_time = data['timestamp']; self.reactor_started.emit(self.reactor_start_time); status_note = "STARTED"
-                        else: data[name] = node.get_value()
-                    except Exception: data[name] = None
-                if status_note: data['bioreactor_status'] = status_note
-                self.data_received.emit(data)
-                self.data_cache.append(data) # Add to cache instead of DB
-                time.sleep(poll_interval_s)
+                data = {'timestamp': time.time()}
+                if sub and not handler.is_stale(stale_after_s): data.update(handler.snapshot())
+                else:
+                    try: values = client.get_values(node_list)
+                    except Exception: values = [None] * len(name_list)
+                    else:
+                        if sub: handler.refresh(name_list, values)
+                    data.update(zip(name_list, values))
+                # Mark STARTED on the 0->1 edge of the run flag; a failed read (None) does not reset the edge
+                run_start = data.pop('run_start', None)
+                if run_start == 1 and self._prev_run_start != 1:
+                    self.reactor_start_time = data['timestamp']; self.reactor_started.emit(self.reactor_start_time); data['bioreactor_status'] = "STARTED"
+                if run_start is not None: self._prev_run_start = run_start
+                self._emit_buf.append(data)
+                if len(self._emit_buf) >= self.EMIT_BATCH_SIZE or time.monotonic() - last_emit >= self.EMIT_INTERVAL_S:
+                    self.data_batch.emit(self._emit_buf); self._emit_buf = []; last_emit = time.monotonic() # New list: the queued signal still references the emitted one
+                self._enqueue(data) # Hand off to the writer thread instead of the DB
+                next_deadline += poll_interval_s; delay = next_deadline - time.monotonic()
+                if delay > 0: time.sleep(delay)
+                elif delay < -poll_interval_s: next_deadline = time.monotonic(); log_event(f"WARNING: Polling fell more than one interval ({poll_ms}ms) behind schedule; resynchronizing.")
 
         except Exception as e: self.status_changed.emit(f"Connection Failed: {e}"); log_event(f"ERROR: OPC client thread failed. Details: {e}")
         finally:
-            self.db_timer.stop()
-            self._flush_cache_to_db() # Final flush to save any remaining data
+            if self._emit_buf: self.data_batch.emit(self._emit_buf); self._emit_buf = []
+            self.running = False
+            with self._cache_cond: self._stop_writer = True; self._cache_cond.notify()
+            writer.join() # Writer flushes any remaining data before exiting
+            if self._binlog: self._import_binary_log(self._binlog); self._binlog = None
+            if self._dropped_samples: log_event(f"WARNING: Dropped {self._dropped_samples} samples because the database writer fell behind.")
+            if sub:
+                try: sub.delete()
+                except Exception as e: log_event(f"WARNING: Failed to delete OPC-UA subscription. Details: {e}")
             if is_connected and client: client.disconnect()
             self.status_changed.emit("Disconnected")
 
-    def _flush_cache_to_db(self):
-        """Thread-safe method to write the cache to the database."""
-        if not self.data_cache:
-            return
-        
-        # Make a copy and clear the original immediately to avoid race conditions
-        cache_snapshot = self.data_cache[:]
-        self.data_cache.clear()
-        
-        self.db_manager.insert_bulk_data(cache_snapshot)
+    def _enqueue(self, data):
+        """Caches a sample for the writer (the oldest is dropped when full) and wakes it once a batch is ready."""
+        with self._cache_cond:
+            if len(self._cache) == self._cache.maxlen: self._dropped_samples += 1
+            self._cache.append(data)
+            if len(self._cache) >= self._flush_batch_size: self._cache_cond.notify()
+
+    def _writer_loop(self):
+        """Writes cached samples to the database in one transaction once a batch is full, the flush interval elapses or on stop."""
+        self._last_flush = time.monotonic(); stopping = False
+        while not stopping:
+            with self._cache_cond:
+                self._cache_cond.wait_for(lambda: self._stop_writer or len(self._cache) >= self._flush_batch_size, timeout=max(0.0, self._last_flush + self._flush_interval_s - time.monotonic()))
+                batch = list(self._cache); self._cache.clear(); stopping = self._stop_writer
+            if self._binlog:
+                try: self._binlog.append_rows(batch)
+                except Exception as e: log_event(f"ERROR: Binary log append failed, writing to the database instead. Details: {e}"); self.db_manager.insert_bulk_data(batch)
+            else: self.db_manager.insert_bulk_data(batch)
+            self._last_flush = time.monotonic()
+
+    def _open_binary_log(self):
+        """Returns the binary sample log if [LOGGING] binary_sink is on; a log left by an earlier session is imported first."""
+        path = self.db_path + '.binlog'
+        try: enabled = self.config.getboolean('LOGGING', 'binary_sink', fallback=False)
+        except ValueError: enabled = False; log_event("WARNING: Invalid 'binary_sink' in config. Logging straight to the database.")
+        if os.path.exists(path): self._import_binary_log(BinaryLogger(path))
+        if not enabled: return None
+        log_event(f"INFO: Logging samples to '{path}'; they are imported into the database when logging stops."); return BinaryLogger(path)
+
+    def _import_binary_log(self, binlog):
+        count = len(binlog); stored = binlog.import_into(self.db_manager); binlog.close(discard=stored)
+        if not stored: log_event(f"WARNING: Kept '{binlog.path}' for the next start because its {count} records could not be imported.")
 
     def stop(self): self.running = False
 
+class ExportThread(QThread):
+    """Runs an Excel export on its own database connection so the GUI stays responsive."""
+    export_finished = Signal(bool, str)
+    def __init__(self, db_path, output_path, start_ts, end_ts, interval_s, rename_map):
+        super().__init__(); self.db_path = db_path; self.export_args = (output_path, start_ts, end_ts, interval_s, rename_map)
+    def run(self):
+        success, msg = DatabaseManager(self.db_path).export_to_excel(*self.export_args); self.export_finished.emit(success, msg)
+
 
 # #############################################################################
 # GUI - CLASS DEFINITIONS FOR TABS AND DIALOGS
@@ -196,8 +451,8 @@ class SettingsTab(QWidget):
     def _init_server_settings(self, p):
         gb = QGroupBox("Server & Polling"); l = QGridLayout(); l.addWidget(QLabel("<b>OPC UA Server Address:</b>"), 0, 0); self.opc_address_edit = QLineEdit(); l.addWidget(self.opc_address_edit, 0, 1); l.addWidget(QLabel("<b>Data Polling Interval (ms):</b>"), 1, 0); self.polling_edit = QSpinBox(); self.polling_edit.setRange(100, 60000); l.addWidget(self.polling_edit, 1, 1); gb.setLayout(l); p.addWidget(gb)
     def _init_tag_settings(self, p):
-        gb = QGroupBox("Tag & Color Configuration"); l = QGridLayout(); l.addWidget(QLabel("<b>Parameter</b>"), 0, 0); l.addWidget(QLabel("<b>Display Name</b>"), 0, 1); l.addWidget(QLabel("<b>PV Node ID</b>"), 0, 2); l.addWidget(QLabel("<b>SP Node ID</b>"), 0, 3); l.addWidget(QLabel("<b>Color (PV / SP)</b>"), 0, 4); tags = ['ph', 'do', 'temp', 'variable1', 'variable2', 'variable3', 'variable4', 'variable5', 'variable6', 'variable7']
-        for i, t in enumerate(tags): self._create_tag_row(l, t, i + 1)
+        gb = QGroupBox("Tag & Color Configuration"); l = QGridLayout(); l.addWidget(QLabel("<b>Parameter</b>"), 0, 0); l.addWidget(QLabel("<b>Display Name</b>"), 0, 1); l.addWidget(QLabel("<b>PV Node ID</b>"), 0, 2); l.addWidget(QLabel("<b>SP Node ID</b>"), 0, 3); l.addWidget(QLabel("<b>Color (PV / SP)</b>"), 0, 4)
+        for i, t in enumerate(self.config_manager.TAG_KEYS): self._create_tag_row(l, t, i + 1)
         gb.setLayout(l); p.addWidget(gb)
     def _create_tag_row(self, l, k, r):
         l.addWidget(QLabel(f"{k.replace('_', ' ').title()}:"), r, 0); n, p, s = QLineEdit(), QLineEdit(), QLineEdit(); l.addWidget(n, r, 1); l.addWidget(p, r, 2); l.addWidget(s, r, 3); self.tag_widgets[k] = {'name': n, 'pv_node': p, 'sp_node': s}; cl = QHBoxLayout(); pv_b = QPushButton(); pv_b.setFixedSize(60, 25); pv_b.clicked.connect(lambda: self._pick_color(k)); cl.addWidget(pv_b); self.color_buttons[k] = pv_b
@@ -247,15 +502,24 @@ class AboutTab(QWidget):
 
 class DashboardTab(QWidget):
     """Dashboard tab for plotting and data export."""
+    BUFFER_WINDOW_S = 3600  # Live buffers start with room for 4x this many seconds of samples before they grow
+    DB_COLUMNS = dict(zip(DatabaseManager.ROW_KEYS, DatabaseManager.COLUMNS))  # Plot key -> sensordata column ('temp' is stored as 'temperature')
+    # One row of _data per plotted key, so each curve's samples are contiguous and reach setData without a copy
+    PLOT_KEYS = tuple(key for key in DatabaseManager.ROW_KEYS if key not in ('timestamp', 'bioreactor_status'))
     def __init__(self, main_window):
-        super().__init__(); self.main_window = main_window; self.config_manager = main_window.config_manager; self.fermentation_start_time = None; self.time_data = []; self.plot_data = {}; self.lines = {}; self.checkboxes = {}; self.view_boxes = {}; self.axes = {}; self.optional_axis_map = {}; self.axis_auto_range_state = {}
+        super().__init__(); self.main_window = main_window; self.config_manager = main_window.config_manager; self.fermentation_start_time = None; self._cap = self._live_capacity(); self._n = 0; self.time_data = np.empty(self._cap); self._col_index = {key: i for i, key in enumerate(self.PLOT_KEYS)}; self._data = np.empty((len(self.PLOT_KEYS), self._cap)); self._eft = np.empty(self._cap); self._eft_n = 0; self._eft_start = None; self._dirty = False; self._autorange_dirty = False; self._visible_keys = set(); self._pens = {}; self.export_thread = None; self.lines = {}; self.checkboxes = {}; self.view_boxes = {}; self.axes = {}; self.optional_axis_map = {}; self.axis_auto_range_state = {}
         layout = QHBoxLayout(self); self._init_plot(); self._init_controls()
         layout.addWidget(self.plot_widget, 4); layout.addWidget(self.controls_group_box, 1)
-        self.update_timer = QTimer(self); self.update_timer.setInterval(500); self.update_timer.timeout.connect(self.redraw_plot); self.update_timer.start()
+        # Repaint at most ~30 times per second, and only after something changed, however fast samples arrive
+        self._redraw_timer = QTimer(self); self._redraw_timer.setInterval(33); self._redraw_timer.timeout.connect(self._flush); self._redraw_timer.start()
         self.apply_settings()
         self.load_ui_state()
     def _init_plot(self):
-        pg.setConfigOptions(antialias=True); self.plot_widget = pg.PlotWidget(); self.legend = self.plot_widget.addLegend(offset=(10, 30)); self.p1 = self.plot_widget.getPlotItem(); self.p1.setLabels(left='pH', bottom='Elapsed Fermentation Time (hours)'); self.p1.showAxis('top'); self.p1.getAxis('top').setStyle(showValues=False); self.p1.getAxis('top').setHeight(150)
+        # Opt-in: pyqtgraph's experimental OpenGL curves are much faster for long runs but draw setpoint lines solid
+        try: use_gl = HAVE_OPENGL and self.config_manager.config.getboolean('SETTINGS', 'use_opengl')
+        except (ValueError, configparser.NoOptionError): use_gl = False; log_event("WARNING: Invalid 'use_opengl' in config. Using default false.")
+        if use_gl: log_event("GUI: Using OpenGL plot rendering.")
+        pg.setConfigOptions(antialias=not use_gl, useOpenGL=use_gl, enableExperimental=use_gl); self.plot_widget = pg.PlotWidget(); self.legend = self.plot_widget.addLegend(offset=(10, 30)); self.p1 = self.plot_widget.getPlotItem(); self.p1.setLabels(left='pH', bottom='Elapsed Fermentation Time (hours)'); self.p1.showAxis('top'); self.p1.getAxis('top').setStyle(showValues=False); self.p1.getAxis('top').setHeight(150)
         self.p_temp = pg.ViewBox(); self.ax_temp = pg.AxisItem('right'); self.p1.layout.addItem(self.ax_temp, 2, 3); self.p1.scene().addItem(self.p_temp); self.ax_temp.linkToView(self.p_temp); self.p_temp.setXLink(self.p1)
         self.p_do = pg.ViewBox(); self.ax_do = pg.AxisItem('right'); self.p1.layout.addItem(self.ax_do, 2, 4); self.p1.scene().addItem(self.p_do); self.ax_do.linkToView(self.p_do); self.p_do.setXLink(self.p1)
         self.p_opt1 = pg.ViewBox(); self.ax_opt1 = pg.AxisItem('right'); self.p1.layout.addItem(self.ax_opt1, 2, 5); self.p1.scene().addItem(self.p_opt1); self.ax_opt1.linkToView(self.p_opt1); self.p_opt1.setXLink(self.p1)
@@ -285,7 +549,7 @@ class DashboardTab(QWidget):
     def _update_views(self):
         for vb_key in ['temp', 'do', 'opt1', 'opt2', 'opt3']: self.view_boxes[vb_key].setGeometry(self.p1.getViewBox().sceneBoundingRect())
     def apply_settings(self):
-        log_event("GUI: Applying display names and colors to plot."); self._clear_plot_items(); config = self.config_manager.get_config(); colors = config['PLOT_COLORS']; tags = config['TAGS']
+        log_event("GUI: Applying display names and colors to plot."); self._clear_plot_items(); colors = self.config_manager.plot_colors; tags = self.config_manager.tags
         self.axes['ph'].setLabel(tags.get('ph_name'), color=colors.get('ph_color')); self.axes['temp'].setLabel(tags.get('temp_name'), color=colors.get('temp_color')); self.axes['do'].setLabel(tags.get('do_name'), color=colors.get('do_color'))
         for key in ['ph', 'temp', 'do']: self._create_or_update_line(key, tags.get(f'{key}_name'), colors.get(f'{key}_color'), key, False); self._create_or_update_line(f'{key}_setpoint', f"{tags.get(f'{key}_name')} SP", colors.get(f'{key}_setpoint_color'), key, True)
         for key in self.optional_variable_keys: self._create_or_update_line(key, tags.get(f'{key}_name'), colors.get(f'{key}_color'), None, False)
@@ -293,15 +557,27 @@ class DashboardTab(QWidget):
         self._apply_axis_limits()
     def _clear_plot_items(self):
         for line in self.lines.values():
+            line.visibleChanged.disconnect() # A dropped line must not keep reporting into the new set
             for view_box in self.view_boxes.values():
                 if line in view_box.addedItems: view_box.removeItem(line)
-        self.legend.clear(); self.lines.clear()
+        self.legend.clear(); self.lines.clear(); self._visible_keys.clear()
+    def _get_pen(self, color, style=Qt.SolidLine, width=2):
+        """Returns a cached pen so re-applying settings does not construct a new QPen per line."""
+        key = (color, style, width)
+        if key not in self._pens: self._pens[key] = pg.mkPen(color, width=width, style=style)
+        return self._pens[key]
     def _create_or_update_line(self, key, name, color, axis_key, is_setpoint):
-        pen = pg.mkPen(color, width=2, style=Qt.DashLine if is_setpoint else Qt.SolidLine)
-        self.plot_data.setdefault(key, []); new_line = pg.PlotDataItem(pen=pen, name=name); self.lines[key] = new_line
+        pen = self._get_pen(color, Qt.DashLine if is_setpoint else Qt.SolidLine)
+        new_line = pg.PlotDataItem(pen=pen, name=name); self.lines[key] = new_line; self._visible_keys.add(key); self._dirty = True
+        new_line.visibleChanged.connect(partial(self._on_line_visibility_changed, key)) # Checkboxes and legend clicks both toggle visibility
+        # Only paint the visible x-range, reduced to min/max per pixel column, so redraws don't scale with run length
+        new_line.setClipToView(True); new_line.setDownsampling(auto=True, method='peak')
         if axis_key: self.view_boxes[axis_key].addItem(self.lines[key])
+    def _on_line_visibility_changed(self, key):
+        if self.lines[key].isVisible(): self._visible_keys.add(key); self._dirty = True # Hidden lines are skipped by redraw_plot, so a newly shown one needs its data set
+        else: self._visible_keys.discard(key)
     def update_optional_plots(self):
-        config = self.config_manager.get_config(); tags = config['TAGS']; colors = config['PLOT_COLORS']
+        tags = self.config_manager.tags; colors = self.config_manager.plot_colors
         for key in self.optional_variable_keys:
             if key in self.lines:
                 for vb in [self.view_boxes['opt1'], self.view_boxes['opt2'], self.view_boxes['opt3']]:
@@ -312,9 +588,9 @@ class DashboardTab(QWidget):
         for i, key in enumerate(checked_optionals[:3]):
             axis_key = f'opt{i+1}'; view_box = self.view_boxes[axis_key]; axis_item = self.axes[axis_key]; line_item = self.lines[key]; color = colors.get(f'{key}_color', '#FFFFFF')
             view_box.addItem(line_item); line_item.show(); axis_item.setLabel(tags.get(f'{key}_name'), color=color); axis_item.show()
-        self._update_axes_autoranges()
+        self._autorange_dirty = True
     def _apply_axis_limits(self):
-        config = self.config_manager.get_config(); limits = config['AXIS_LIMITS']; log_event("GUI: Manual axis limits applied.")
+        limits = self.config_manager.axis_limits; log_event("GUI: Manual axis limits applied.")
         for key, axis in self.axes.items():
             self.axis_auto_range_state[key.rstrip('123')] = False
             try:
@@ -325,56 +601,83 @@ class DashboardTab(QWidget):
     def _enable_auto_range_all(self):
         log_event("GUI: All axes set to auto-range mode.")
         for key, view_box in self.view_boxes.items(): self.axis_auto_range_state[key] = True
-        self._update_axes_autoranges()
+        self._autorange_dirty = True
     def _update_axes_autoranges(self):
         for key, view_box in self.view_boxes.items():
             if any(isinstance(item, pg.PlotDataItem) and item.isVisible() for item in view_box.allChildren()): view_box.enableAutoRange()
         log_event("GUI: Axes autorange updated.")
+    def _live_capacity(self):
+        try: poll_ms = max(self.config_manager.config.getint('SETTINGS', 'polling_interval_ms'), 1)
+        except (ValueError, configparser.NoOptionError): poll_ms = 1000
+        return max(4096, 4 * self.BUFFER_WINDOW_S * 1000 // poll_ms)
     def clear_all_data(self):
-        self.time_data.clear();
-        for key in self.plot_data: self.plot_data[key].clear()
-        self.fermentation_start_time = None
+        self._n = 0; self._eft_n = 0; self.fermentation_start_time = None
+        if self._cap < self._live_capacity():
+            self._cap = self._live_capacity(); self.time_data = np.empty(self._cap); self._data = np.empty((len(self.PLOT_KEYS), self._cap))
         if hasattr(self, 'start_line_item'): self.p1.removeItem(self.start_line_item); del self.start_line_item
         self.redraw_plot(); log_event("GUI: All plot data cleared.")
     def display_historical_data(self, df):
         self.clear_all_data(); start_events = df[df['bioreactor_status'] == 'STARTED']
         if not start_events.empty: self.set_fermentation_start(start_events['timestamp'].iloc[0])
-        self.time_data = df['timestamp'].tolist()
-        for key in self.plot_data:
-            if key in df.columns: self.plot_data[key] = df[key].tolist()
-        self.redraw_plot(); self._enable_auto_range_all()
+        n = len(df); self._cap = max(self._cap, n); self.time_data = np.empty(self._cap); self.time_data[:n] = df['timestamp'].to_numpy(dtype=np.float64)
+        self._data = np.full((len(self.PLOT_KEYS), self._cap), np.nan)
+        for key, i in self._col_index.items():
+            column = self.DB_COLUMNS.get(key, key)
+            if column in df.columns: self._data[i, :n] = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        self._n = n; self.redraw_plot(); self._enable_auto_range_all()
     def set_fermentation_start(self, timestamp):
-        if self.fermentation_start_time is None: self.fermentation_start_time = timestamp; self.start_line_item = pg.InfiniteLine(pos=0, angle=90, movable=False, pen=pg.mkPen('red', width=3, style=Qt.DotLine), label="EFT Start"); self.p1.addItem(self.start_line_item); self.redraw_plot()
-    def update_plot_data(self, data):
-        self.time_data.append(data.get('timestamp'))
-        for key in self.plot_data: self.plot_data[key].append(self._sanitize_value(data.get(key, None)))
-    def _sanitize_value(self, value):
-        if isinstance(value, (int, float)): return value
-        return None
+        if self.fermentation_start_time is None: self.fermentation_start_time = timestamp; self.start_line_item = pg.InfiniteLine(pos=0, angle=90, movable=False, pen=self._get_pen('red', Qt.DotLine, 3), label="EFT Start"); self.p1.addItem(self.start_line_item); self._dirty = True # EFT is re-based on the next timer redraw
+    @Slot(object)
+    def update_plot_data_batch(self, batch):
+        """Stores a batch of live samples in the plot buffers; the redraw timer repaints them."""
+        self._append_samples(batch); self._dirty = True
+    def _flush(self):
+        if self._dirty: self.redraw_plot()
+        # Auto-ranged boxes follow new data on their own; they only need re-enabling after visibility or mode changes
+        if self._autorange_dirty: self._autorange_dirty = False; self._update_axes_autoranges()
+    def _append_samples(self, batch):
+        """Copies live samples into the plot buffers with one float64 cast per batch; missing values become NaN."""
+        n = self._n; m = len(batch)
+        while n + m > self._cap: self._grow_buffers()
+        values = samples_to_array(batch, self.PLOT_KEYS); self.time_data[n:n + m] = [data.get('timestamp') for data in batch]; self._data[:, n:n + m] = values.T
+        self._n = n + m
+    def _grow_buffers(self):
+        """Doubles the capacity of the sample buffers; only the first self._n entries are meaningful."""
+        self._cap *= 2; self.time_data = np.resize(self.time_data, self._cap)
+        data = np.empty((len(self.PLOT_KEYS), self._cap)); data[:, :self._n] = self._data[:, :self._n]; self._data = data
     def redraw_plot(self):
-        if not self.time_data:
+        self._dirty = False; n = self._n # Direct calls (historical load) cover any pending timer repaint
+        if not n:
             for line in self.lines.values(): line.clear()
             return
+        # EFT hours are cached; only samples added since the last redraw are converted unless the start moved
         start_time = self.fermentation_start_time or self.time_data[0]
-        eft_data_hours = [(t - start_time) / 3600.0 for t in self.time_data]
-        for key, line in self.lines.items():
-            if line.isVisible():
-                if len(self.plot_data.get(key, [])) == len(eft_data_hours):
-                    try: line.setData(eft_data_hours, self.plot_data[key])
-                    except Exception as e: log_event(f"ERROR: Failed to update plot for key '{key}'. Details: {e}")
-        for axis_key, is_auto in self.axis_auto_range_state.items():
-            if is_auto:
-                view_box = self.view_boxes.get(axis_key)
-                if view_box and any(isinstance(item, pg.PlotDataItem) and item.isVisible() for item in view_box.allChildren()): view_box.enableAutoRange()
+        if start_time != self._eft_start: self._eft_start = start_time; self._eft_n = 0
+        if len(self._eft) != self._cap: self._eft = np.resize(self._eft, self._cap)
+        done = self._eft_n; self._eft[done:n] = (self.time_data[done:n] - start_time) * (1.0 / 3600.0); self._eft_n = n; eft_data_hours = self._eft[:n]
+        for key in self._visible_keys:
+            try: self.lines[key].setData(eft_data_hours, self._data[self._col_index[key], :n])
+            except Exception as e: log_event(f"ERROR: Failed to update plot for key '{key}'. Details: {e}")
+    def _last_export_dir(self):
+        last_dir = self.config_manager.config.get('UI_STATE', 'last_export_dir', fallback='')
+        return last_dir if os.path.isdir(last_dir) else ''
+    def _remember_export_dir(self, path):
+        # Saved right away: reload() on client start would otherwise overwrite it with the value in the file
+        self.config_manager.config.set('UI_STATE', 'last_export_dir', os.path.dirname(os.path.abspath(path)).replace('%', '%%')); self.config_manager.save_config()
     def save_graph_image(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Save Graph", "", "PNG (*.png);;JPG (*.jpg)");
-        if path: exporter = pg.exporters.ImageExporter(self.plot_widget.plotItem); exporter.export(path); log_event(f"GUI: Graph saved to {path}")
+        # Shift+click saves straight into the last used folder instead of opening the file dialog
+        last_dir = self._last_export_dir()
+        if last_dir and QApplication.keyboardModifiers() & Qt.ShiftModifier: path = os.path.join(last_dir, f"graph_{datetime.datetime.now():%Y%m%d_%H%M%S}.png")
+        else: path, _ = QFileDialog.getSaveFileName(self, "Save Graph", last_dir, "PNG (*.png);;JPG (*.jpg)")
+        if path: self._remember_export_dir(path); from pyqtgraph.exporters import ImageExporter; exporter = ImageExporter(self.plot_widget.plotItem); exporter.parameters()['antialias'] = False; exporter.export(path); log_event(f"GUI: Graph saved to {path}")
     def show_export_dialog(self):
+        if self.export_thread and self.export_thread.isRunning(): QMessageBox.information(self, "Export Status", "An export is already in progress."); return
         dialog = ExportDialog(self)
         if dialog.exec():
             start_ts, end_ts, interval = dialog.get_values()
-            path, _ = QFileDialog.getSaveFileName(self, "Save Exported Data", "", "Excel Files (*.xlsx)")
-            if path: db_manager = DatabaseManager(self.main_window.current_db_path); success, msg = db_manager.export_to_excel(path, start_ts, end_ts, interval, self.config_manager.get_config()); QMessageBox.information(self, "Export Status", msg)
+            path, _ = QFileDialog.getSaveFileName(self, "Save Exported Data", self._last_export_dir(), "Excel Files (*.xlsx)")
+            if path: self._remember_export_dir(path); self.export_thread = ExportThread(self.main_window.current_db_path, path, start_ts, end_ts, interval, self.config_manager.rename_map); self.export_thread.export_finished.connect(self._on_export_finished); self.export_thread.start()
+    def _on_export_finished(self, success, msg): QMessageBox.information(self, "Export Status", msg)
     def save_ui_state(self):
         config = self.config_manager.get_config()
         if not config.has_section('UI_STATE'): config.add_section('UI_STATE')
@@ -424,9 +727,9 @@ class MainWindow(QMainWindow):
 
     def start_opc_client(self):
         if self.opc_thread and self.opc_thread.isRunning(): return
-        self.initial_connection_notified = False; self.dashboard_tab.clear_all_data(); self.config_manager.get_config(); self.dashboard_tab.apply_settings()
-        self.opc_thread = OpcClientThread(self.config_manager.config, self.current_db_path)
-        self.opc_thread.data_received.connect(self.dashboard_tab.update_plot_data); self.opc_thread.status_changed.connect(self.settings_tab.update_status_label); self.opc_thread.status_changed.connect(self.handle_connection_status); self.opc_thread.reactor_started.connect(self.dashboard_tab.set_fermentation_start)
+        self.initial_connection_notified = False; self.dashboard_tab.clear_all_data(); self.config_manager.reload(); self.dashboard_tab.apply_settings()
+        self.opc_thread = OpcClientThread(self.config_manager, self.current_db_path)
+        self.opc_thread.data_batch.connect(self.dashboard_tab.update_plot_data_batch, Qt.QueuedConnection); self.opc_thread.status_changed.connect(self.settings_tab.update_status_label); self.opc_thread.status_changed.connect(self.handle_connection_status); self.opc_thread.reactor_started.connect(self.dashboard_tab.set_fermentation_start)
         self.opc_thread.finished.connect(self.on_thread_finished)
         self.opc_thread.start()
         self.settings_tab.start_button.setEnabled(False); self.settings_tab.stop_button.setEnabled(True)
@@ -464,6 +767,7 @@ class MainWindow(QMainWindow):
         log_event("INFO: Application closing.")
         self.dashboard_tab.save_ui_state()
         self.stop_opc_client()
+        if self.dashboard_tab.export_thread: self.dashboard_tab.export_thread.wait() # Let a running export finish writing its file
         event.accept()
 
 